@@ -1,8 +1,12 @@
 import os
 import time
+import asyncio
 import base64
 import subprocess
 import json
+import re
+import struct
+import orjson
 import random
 from datetime import datetime
 from typing import List, Dict, Any, Optional
@@ -10,21 +14,107 @@ import google.generativeai as genai
 from PIL import Image
 import io
 import logging
+from collections import deque
 from dotenv import load_dotenv
 
+# Stubs generated from $ANDROID_SDK_ROOT/emulator/lib/emulator_controller.proto
+try:
+    import grpc
+    from emulator_controller_pb2 import ImageFormat, KeyboardEvent
+    from emulator_controller_pb2_grpc import EmulatorControllerStub
+except ImportError:
+    grpc = None
+
 # Load API Key from .env
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 DEVICE_NAME = "emulator-5554"
+GEMINI_MODEL = "gemini-2.0-flash-exp"
+# Frames are shrunk to fit this box and sent as JPEG; Gemini downsamples larger images anyway
+GEMINI_IMAGE_SIZE = (448, 448)
+GEMINI_JPEG_QUALITY = 80
+# Frames whose 64-bit dHash differs from the previous one in fewer bits reuse its analysis
+SCREEN_HASH_THRESHOLD = 5
+REASONING_HISTORY_LIMIT = 50
+# Spellings like "move_up", "go_up" and "press_a" resolve to the bare button name
+ACTION_ALIASES = {
+    "move_": ("up", "down", "left", "right"),
+    "go_": ("up", "down", "left", "right"),
+    "press_": ("a", "b", "start", "select"),
+}
+ACTION_PREFIXES = tuple(ACTION_ALIASES)
+# Echoed after each batch of shell commands, followed by the batch's exit status
+SHELL_SENTINEL = b"__pokemon_vlm_bot_done__"
+# Most frames only need a one-word answer; the full JSON analysis runs every
+# FULL_ANALYSIS_INTERVAL frames, once the bot looks stuck, or when the short answer is unusable
+FULL_ANALYSIS_INTERVAL = 10
+FAST_PATH_STUCK_LIMIT = 3
+FAST_PATH_ACTIONS = ("up", "down", "left", "right", "a", "b", "start", "wait")
+FAST_PATH_PROMPT = ("You are playing Pokémon FireRed. Which button should be pressed next? "
+                    "Reply with exactly one of: " + " ".join(FAST_PATH_ACTIONS))
+# Port the emulator was started with via `-grpc <port>`; leave unset to drive it over adb
+EMULATOR_GRPC_PORT = os.getenv("EMULATOR_GRPC_PORT")
+
+# Android keycode -> Linux evdev code, as expected by EmulatorController.sendKey
+EVDEV_KEYCODES = {
+    19: 103,   # DPAD_UP -> KEY_UP
+    20: 108,   # DPAD_DOWN -> KEY_DOWN
+    21: 105,   # DPAD_LEFT -> KEY_LEFT
+    22: 106,   # DPAD_RIGHT -> KEY_RIGHT
+    96: 304,   # BUTTON_A -> BTN_A
+    97: 305,   # BUTTON_B -> BTN_B
+    102: 310,  # BUTTON_L1 -> BTN_TL
+    103: 311,  # BUTTON_R1 -> BTN_TR
+    108: 315,  # BUTTON_START -> BTN_START
+    109: 314,  # BUTTON_SELECT -> BTN_SELECT
+}
+
+# Fixed instructions, sent as the model's system_instruction; each call only adds the current game state.
+# Gemini context caching is deliberately not used: this preamble is a few hundred tokens, far below the
+# API's minimum cacheable size, and experimental models such as gemini-2.0-flash-exp don't support it.
+ANALYSIS_PREAMBLE = """You are an AI agent playing Pokémon FireRed inside an emulator. Your job is to analyze the screenshot and suggest the next action based strictly on the current game state.
+
+Only respond with **allowed actions** from this list:
+- move_up
+- move_down
+- move_left
+- move_right
+- press_a
+- press_b
+- press_start
+- press_select
+
+Do NOT use free-form actions like "interact with PC" or "walk to stairs". Translate them into one of the allowed commands. For example, if the goal is to go down the stairs, say "move_right" (or the correct direction). If interaction is needed, use "press_a".
+
+Provide your response in the following JSON format (no extra explanation):
+{
+  "scene_description": "...",
+  "current_location": "...",
+  "pokemon_visible": [...],
+  "menu_state": "...",
+  "health_status": "...",
+  "action": "<one of the allowed actions only>",
+  "reasoning": "...",
+  "panic_level": 0-10,
+  "objectives": [...],
+  "confidence": 0-10
+}
+"""
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
+def _put_latest(queue: asyncio.Queue, item):
+    # Backpressure by dropping: a stale frame or action is replaced rather than queued behind
+    if queue.full():
+        queue.get_nowait()
+        queue.task_done()
+    queue.put_nowait(item)
+
 class PokemonVLMBot:
-    def __init__(self, api_key: str, device_name: str = "emulator-5554"):
+    def __init__(self, api_key: str, device_name: str = "emulator-5554", grpc_port: Optional[int] = None):
         self.api_key = api_key
         self.device_name = device_name
-        self.screenshot_path = "current_screen.png"
 
         self.game_state = {
             "current_location": "",
@@ -34,41 +124,71 @@ class PokemonVLMBot:
             "panic_mode": False,
             "stuck_counter": 0,
             "last_action": "",
-            "reasoning_history": []
+            "reasoning_history": deque(maxlen=REASONING_HISTORY_LIMIT)
         }
 
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        # gRPC keeps one HTTP/2 channel open that the SDK reuses for every generate_content call
+        genai.configure(api_key=api_key, transport="grpc")
+        self.model = self._create_model()
+        self._fast_model = genai.GenerativeModel(
+            GEMINI_MODEL, generation_config=genai.GenerationConfig(max_output_tokens=4, temperature=0))
+        self._warm_up_model()
 
         self.button_mappings = {
-            "a": "KEYCODE_BUTTON_A",
-            "b": "KEYCODE_BUTTON_B",
-            "start": "KEYCODE_BUTTON_START",
-            "select": "KEYCODE_BUTTON_SELECT",
-            "up": "KEYCODE_DPAD_UP",
-            "down": "KEYCODE_DPAD_DOWN",
-            "left": "KEYCODE_DPAD_LEFT",
-            "right": "KEYCODE_DPAD_RIGHT",
-            "l": "KEYCODE_BUTTON_L1",
-            "r": "KEYCODE_BUTTON_R1",
-
-            # Added flexible mappings
-            "move_up": "KEYCODE_DPAD_UP",
-            "move_down": "KEYCODE_DPAD_DOWN",
-            "move_left": "KEYCODE_DPAD_LEFT",
-            "move_right": "KEYCODE_DPAD_RIGHT",
-            "go_up": "KEYCODE_DPAD_UP",
-            "go_down": "KEYCODE_DPAD_DOWN",
-            "go_left": "KEYCODE_DPAD_LEFT",
-            "go_right": "KEYCODE_DPAD_RIGHT",
-            "press_a": "KEYCODE_BUTTON_A",
-            "press_b": "KEYCODE_BUTTON_B",
-            "press_start": "KEYCODE_BUTTON_START",
-            "press_select": "KEYCODE_BUTTON_SELECT"
+            "a": 96,
+            "b": 97,
+            "start": 108,
+            "select": 109,
+            "up": 19,
+            "down": 20,
+            "left": 21,
+            "right": 22,
+            "l": 102,
+            "r": 103
         }
+        # Longest names first so "move_up" wins over "up" in the single regex pass
+        self._fallback_keys = tuple(sorted(set(self.button_mappings) | {prefix + button
+                                                                        for prefix, buttons in ACTION_ALIASES.items()
+                                                                        for button in buttons},
+                                           key=len, reverse=True))
+        self._action_re = re.compile(r'\b(' + '|'.join(map(re.escape, self._fallback_keys)) + r')\b', re.IGNORECASE)
+        # Shell command bytes per action, so sending a key is a dict lookup and a write
+        self._shell_commands = {action: f"input keyevent {keycode}".encode()
+                                for action, keycode in self.button_mappings.items()}
+
+        self._emulator = None
+        self._shell = None
+        self._last_hash = None
+        self._last_analysis = None
+        self._frames_since_full_analysis = FULL_ANALYSIS_INTERVAL
+        self._last_action_at = 0.0
+        self._json_decoder = json.JSONDecoder()
+        if grpc_port:
+            if grpc is None:
+                logger.warning("grpc_port set but grpcio or the emulator_controller stubs are missing, falling back to adb")
+            else:
+                channel = grpc.insecure_channel(f'localhost:{grpc_port}',
+                                                options=[('grpc.max_receive_message_length', 32 << 20)])
+                self._emulator = EmulatorControllerStub(channel)
+                self._key_events = {
+                    action: KeyboardEvent(codeType=KeyboardEvent.Evdev, eventType=KeyboardEvent.keypress,
+                                          keyCode=EVDEV_KEYCODES[keycode])
+                    for action, keycode in self.button_mappings.items()
+                }
+                logger.info(f"Using emulator gRPC controller on port {grpc_port}")
 
         self._check_adb_connection()
 
+    def _create_model(self) -> genai.GenerativeModel:
+        return genai.GenerativeModel(GEMINI_MODEL, system_instruction=ANALYSIS_PREAMBLE)
+
+    def _warm_up_model(self):
+        # count_tokens is free and goes through the same client, so the TLS handshake happens before the game loop
+        try:
+            self.model.count_tokens("ping")
+        except Exception as e:
+            logger.warning(f"Gemini warm-up failed: {e}")
+
     def _check_adb_connection(self):
         try:
             result = subprocess.run(['adb', 'devices'], capture_output=True, text=True)
@@ -84,73 +204,171 @@ class PokemonVLMBot:
             logger.error(f"ADB connection failed: {e}")
             return False
 
-    def take_screenshot(self) -> Optional[str]:
+    def _get_shell(self) -> subprocess.Popen:
+        # One long-lived `adb shell` session; respawned if the device dropped it
+        if self._shell is None or self._shell.poll() is not None:
+            self._shell = subprocess.Popen(['adb', '-s', self.device_name, 'shell'], stdin=subprocess.PIPE,
+                                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return self._shell
+
+    def _run_shell(self, command: bytes):
+        # Blocks until the device has actually run the command, and raises if it failed
+        shell = self._get_shell()
+        shell.stdin.write(command + b"; echo " + SHELL_SENTINEL + b" $?\n")
+        shell.stdin.flush()
+        output = []
+        while True:
+            line = shell.stdout.readline()
+            if not line:
+                raise RuntimeError("adb shell exited")
+            if line.startswith(SHELL_SENTINEL):
+                status = int(line.split()[1])
+                if status != 0:
+                    message = b''.join(output).decode(errors='replace').strip()
+                    raise RuntimeError(f"shell command exited with status {status}: {message}")
+                return
+            output.append(line)
+
+    def close(self):
+        if self._shell is not None and self._shell.poll() is None:
+            self._shell.stdin.close()
+            self._shell.terminate()
+            self._shell.wait()
+        self._shell = None
+
+    def take_screenshot(self) -> Optional[Image.Image]:
         try:
-            subprocess.run(['adb', '-s', self.device_name, 'shell', 'screencap', '-p',
-                            f'/sdcard/{self.screenshot_path}'], check=True)
-            subprocess.run(['adb', '-s', self.device_name, 'pull',
-                            f'/sdcard/{self.screenshot_path}', self.screenshot_path], check=True)
-            return self.screenshot_path
+            if self._emulator:
+                # The emulator scales the frame down itself and hands back raw pixels, so nothing needs decoding
+                frame = self._emulator.getScreenshot(ImageFormat(format=ImageFormat.RGBA8888,
+                                                                 width=GEMINI_IMAGE_SIZE[0],
+                                                                 height=GEMINI_IMAGE_SIZE[1]))
+                return Image.frombuffer('RGBX', (frame.format.width, frame.format.height), frame.image,
+                                        'raw', 'RGBX', 0, 1)
+            # Raw screencap streamed over the adb pipe: no PNG encode on the device and no decode here
+            result = subprocess.run(['adb', '-s', self.device_name, 'exec-out', 'screencap'],
+                                    capture_output=True, check=True)
+            return self._decode_screencap(result.stdout)
         except Exception as e:
             logger.error(f"Screenshot failed: {e}")
             return None
 
+    def _decode_screencap(self, data: bytes) -> Optional[Image.Image]:
+        if len(data) < 12:
+            logger.error("Screenshot failed: truncated screencap output")
+            return None
+        width, height, pixel_format = struct.unpack_from('<3I', data)
+        if pixel_format not in (1, 2):  # RGBA_8888, RGBX_8888
+            logger.error(f"Screenshot failed: unsupported pixel format {pixel_format}")
+            return None
+        # Newer Android versions append a colour-space field to the header, so read the pixels from the end
+        pixel_bytes = width * height * 4
+        if len(data) < 12 + pixel_bytes:
+            logger.error("Screenshot failed: truncated screencap output")
+            return None
+        return Image.frombuffer('RGBX', (width, height), memoryview(data)[len(data) - pixel_bytes:],
+                                'raw', 'RGBX', 0, 1)
+
     def send_input(self, action: str, duration: float = 0.1) -> bool:
+        return self.send_inputs([action], duration)
+
+    def _normalize_action(self, action: str) -> str:
+        # "Move Up", "go-up" and "move_up" all become "up"
+        action = re.sub(r'[\s-]+', '_', str(action).strip().lower())
+        for prefix, buttons in ACTION_ALIASES.items():
+            if action.startswith(prefix) and action[len(prefix):] in buttons:
+                return action[len(prefix):]
+        return action
+
+    def send_inputs(self, actions: List[str], duration: float = 0.1) -> bool:
         try:
-            keycode = self.button_mappings.get(action)
-            if keycode:
-                subprocess.run(['adb', '-s', self.device_name, 'shell', 'input', 'keyevent', keycode], check=True)
-                logger.info(f"Sent input: {action}")
-                time.sleep(duration)
-                return True
-            else:
-                logger.error(f"Unknown action: {action}")
+            actions = [self._normalize_action(action) for action in actions]
+            unknown = [action for action in actions if action not in self.button_mappings]
+            if unknown:
+                logger.error(f"Unknown action: {', '.join(unknown)}")
                 return False
+
+            if self._emulator:
+                for action in actions:
+                    self._emulator.sendKey(self._key_events[action])
+            else:
+                # The whole sequence goes to the shell in one write and one round-trip
+                self._run_shell(b' && '.join(self._shell_commands[action] for action in actions))
+            logger.info(f"Sent input: {', '.join(actions)}")
+            time.sleep(duration * len(actions))
+            return True
         except Exception as e:
             logger.error(f"Input failed: {e}")
             return False
 
-    def analyze_screen_with_gemini(self, screenshot_path: str) -> Dict[str, Any]:
+    def analyze_screen(self, image: Image.Image) -> Dict[str, Any]:
+        image.thumbnail(GEMINI_IMAGE_SIZE, Image.BILINEAR)
+
+        screen_hash = self._screen_hash(image)
+        stuck = self.game_state["stuck_counter"] > FAST_PATH_STUCK_LIMIT
+        # When stuck, an unchanged screen is exactly the case that needs a fresh full analysis
+        if (not stuck and self._last_analysis is not None
+                and bin(screen_hash ^ self._last_hash).count('1') < SCREEN_HASH_THRESHOLD):
+            logger.info("Screen unchanged, reusing previous analysis")
+            return dict(self._last_analysis)
+
+        jpeg = io.BytesIO()
+        image.save(jpeg, 'JPEG', quality=GEMINI_JPEG_QUALITY)
+        jpeg = jpeg.getvalue()
+
+        analysis = None
+        if (self._last_analysis is not None
+                and self._frames_since_full_analysis < FULL_ANALYSIS_INTERVAL
+                and not stuck):
+            analysis = self.analyze_fast(jpeg)
+        if analysis is None:
+            analysis = self.analyze_screen_with_gemini(jpeg)
+            self._frames_since_full_analysis = 0
+        else:
+            self._frames_since_full_analysis += 1
+
+        # Only a real key press is worth replaying; "wait", unknown actions and errors leave the screen
+        # unchanged, so caching them would stop Gemini from ever being asked again
+        if self._normalize_action(analysis.get("action", "wait")) in self.button_mappings:
+            self._last_hash = screen_hash
+            self._last_analysis = analysis
+        return analysis
+
+    def analyze_fast(self, jpeg: bytes) -> Optional[Dict[str, Any]]:
         try:
-            with open(screenshot_path, 'rb') as img_file:
-                image = Image.open(io.BytesIO(img_file.read()))
-            prompt = self._create_analysis_prompt()
-            response = self.model.generate_content([prompt, image])
+            response = self._fast_model.generate_content([FAST_PATH_PROMPT, {'mime_type': 'image/jpeg', 'data': jpeg}])
+            action = response.text.strip().strip('.').lower()
+        except Exception as e:
+            logger.warning(f"Fast-path analysis failed: {e}")
+            return None
+        if action not in FAST_PATH_ACTIONS:
+            logger.info(f"Ambiguous fast-path answer {action!r}, running full analysis")
+            return None
+        # Scene, location and panic level carry over from the last full analysis
+        analysis = dict(self._last_analysis)
+        analysis.update(action=action, reasoning="Fast-path decision", confidence=5)
+        return analysis
+
+    def analyze_screen_with_gemini(self, jpeg: bytes) -> Dict[str, Any]:
+        try:
+            contents = [self._create_analysis_prompt(), {'mime_type': 'image/jpeg', 'data': jpeg}]
+            response = self.model.generate_content(contents)
             return self._parse_gemini_response(response.text)
         except Exception as e:
             logger.error(f"Gemini analysis failed: {e}")
             return {"error": str(e), "action": "wait", "reasoning": "Analysis failed"}
 
-    def _create_analysis_prompt(self) -> str:
-        return f"""You are an AI agent playing Pokémon FireRed inside an emulator. Your job is to analyze the screenshot and suggest the next action based strictly on the current game state.
-
-Only respond with **allowed actions** from this list:
-- move_up
-- move_down
-- move_left
-- move_right
-- press_a
-- press_b
-- press_start
-- press_select
-
-Do NOT use free-form actions like "interact with PC" or "walk to stairs". Translate them into one of the allowed commands. For example, if the goal is to go down the stairs, say "move_right" (or the correct direction). If interaction is needed, use "press_a".
-
-Provide your response in the following JSON format (no extra explanation):
-{{
-  "scene_description": "...",
-  "current_location": "...",
-  "pokemon_visible": [...],
-  "menu_state": "...",
-  "health_status": "...",
-  "action": "<one of the allowed actions only>",
-  "reasoning": "...",
-  "panic_level": 0-10,
-  "objectives": [...],
-  "confidence": 0-10
-}}
+    def _screen_hash(self, image: Image.Image) -> int:
+        # dHash: shrink to 9x8 grayscale and record whether each pixel is brighter than its left neighbour
+        pixels = list(image.convert('L').resize((9, 8), Image.BILINEAR).getdata())
+        bits = 0
+        for row in range(8):
+            for col in range(8):
+                bits = (bits << 1) | (pixels[row * 9 + col + 1] > pixels[row * 9 + col])
+        return bits
 
-Current Game State:
+    def _create_analysis_prompt(self) -> str:
+        return f"""Current Game State:
 - Location: {self.game_state['current_location']}
 - Last Action: {self.game_state['last_action']}
 - Stuck Counter: {self.game_state['stuck_counter']}
@@ -161,9 +379,11 @@ Current Game State:
     def _parse_gemini_response(self, response_text: str) -> Dict[str, Any]:
         try:
             start = response_text.find('{')
-            end = response_text.rfind('}') + 1
-            if start != -1 and end != -1:
-                parsed = json.loads(response_text[start:end])
+            if start != -1:
+                # Decodes the first balanced object in place, ignoring anything Gemini adds after it
+                parsed, _ = self._json_decoder.raw_decode(response_text, start)
+                if "action" in parsed:
+                    parsed["action"] = self._normalize_action(parsed["action"])
                 for field in ['action', 'reasoning', 'scene_description']:
                     parsed.setdefault(field, "Not provided")
                 return parsed
@@ -173,14 +393,18 @@ Current Game State:
             return self._fallback_parse(response_text)
 
     def _fallback_parse(self, text: str) -> Dict[str, Any]:
-        for action in self.button_mappings:
-            if action in text.lower():
-                return {
-                    "action": action,
-                    "reasoning": text,
-                    "scene_description": "Parsing failed, used fallback.",
-                    "confidence": 3
-                }
+        # Overlaps already resolve to the longest name. Across matches, deliberate spellings like "move_up" beat
+        # bare words, which beat single letters (often just an article), and ties go to the leftmost
+        matches = self._action_re.findall(text)
+        if matches:
+            action = min(matches, key=lambda match: (0 if match.lower().startswith(ACTION_PREFIXES)
+                                                     else 2 if len(match) == 1 else 1))
+            return {
+                "action": self._normalize_action(action),
+                "reasoning": text,
+                "scene_description": "Parsing failed, used fallback.",
+                "confidence": 3
+            }
         return {
             "action": "wait",
             "reasoning": "Unable to determine action",
@@ -189,6 +413,11 @@ Current Game State:
         }
 
     def update_game_state(self, analysis: Dict[str, Any]):
+        if analysis.get("action") == self.game_state.get("last_action"):
+            self.game_state["stuck_counter"] += 1
+        else:
+            self.game_state["stuck_counter"] = 0
+
         self.game_state["current_location"] = analysis.get("current_location", "Unknown")
         self.game_state["last_action"] = analysis.get("action", "wait")
 
@@ -203,11 +432,6 @@ Current Game State:
         elif panic_level <= 3:
             self.game_state["panic_mode"] = False
 
-        if analysis.get("action") == self.game_state.get("last_action"):
-            self.game_state["stuck_counter"] += 1
-        else:
-            self.game_state["stuck_counter"] = 0
-
         self.game_state["reasoning_history"].append({
             "timestamp": datetime.now().isoformat(),
             "reasoning": analysis.get("reasoning", ""),
@@ -215,9 +439,6 @@ Current Game State:
             "confidence": analysis.get("confidence", 0)
         })
 
-        if len(self.game_state["reasoning_history"]) > 50:
-            self.game_state["reasoning_history"] = self.game_state["reasoning_history"][-50:]
-
     def log_analysis(self, analysis: Dict[str, Any]):
         logger.info("Analysis Summary:")
         logger.info(f"   Scene: {analysis.get('scene_description', 'N/A')}")
@@ -233,57 +454,106 @@ Current Game State:
 
     def handle_stuck_state(self) -> bool:
         if self.game_state["stuck_counter"] > 10:
-            logger.warning("AI seems stuck. Trying random input.")
-            self.send_input(random.choice(['up', 'down', 'left', 'right', 'b', 'start']))
+            logger.warning("AI seems stuck. Trying random inputs.")
+            if not self.send_inputs(random.choices(['up', 'down', 'left', 'right', 'b', 'start'], k=3)):
+                return False
             self.game_state["stuck_counter"] = 0
             time.sleep(1)
             return True
         return False
 
-    def run_game_loop(self, max_iterations: int = 1000, delay: float = 3.0):
-        logger.info("Starting the Pokemon VLM bot.")
-        for i in range(max_iterations):
+    async def _capture_frames(self, frames: asyncio.Queue, delay: float):
+        while True:
+            started = time.perf_counter()
+            captured_at = time.monotonic()
             try:
-                logger.info(f"Iteration {i + 1}/{max_iterations}")
-                screenshot = self.take_screenshot()
-                if not screenshot:
-                    logger.error("Screenshot failed, skipping iteration")
-                    time.sleep(delay)
-                    continue
-
-                analysis = self.analyze_screen_with_gemini(screenshot)
+                screenshot = await asyncio.to_thread(self.take_screenshot)
+            except Exception as e:
+                logger.error(f"Error during capture: {e}")
+                screenshot = None
+            # Failures are passed on too, so they use up an iteration and max_iterations still bounds the run
+            _put_latest(frames, (captured_at, screenshot))
+            # Time already spent capturing counts towards the delay
+            await asyncio.sleep(max(0.0, delay - (time.perf_counter() - started)))
+
+    async def _analyze_frames(self, frames: asyncio.Queue, actions: asyncio.Queue, max_iterations: int):
+        i = 0
+        while i < max_iterations:
+            captured_at, screenshot = await frames.get()
+            frames.task_done()
+            # A frame taken before the last key landed would show the old screen and get the same action replayed
+            if screenshot is not None and captured_at < self._last_action_at:
+                continue
+            i += 1
+            logger.info(f"Iteration {i}/{max_iterations}")
+            if screenshot is None:
+                logger.error("Screenshot failed, skipping iteration")
+                continue
+            try:
+                analysis = await asyncio.to_thread(self.analyze_screen, screenshot)
                 self.update_game_state(analysis)
                 self.log_analysis(analysis)
+                _put_latest(actions, analysis)
+                # The next decision has to see this action's effect
+                await actions.join()
+            except Exception as e:
+                logger.error(f"Error during analysis: {e}")
 
-                if self.handle_stuck_state():
-                    continue
-
-                action = analysis.get("action", "wait")
-                if action != "wait":
-                    self.send_input(action)
-
-                time.sleep(delay)
-
-            except KeyboardInterrupt:
-                logger.info("Interrupted by user.")
-                break
+    async def _apply_actions(self, actions: asyncio.Queue):
+        while True:
+            analysis = await actions.get()
+            try:
+                sent = await asyncio.to_thread(self.handle_stuck_state)
+                if not sent:
+                    action = analysis.get("action", "wait")
+                    if action != "wait":
+                        sent = await asyncio.to_thread(self.send_input, action)
+                if sent:
+                    self._last_action_at = time.monotonic()
             except Exception as e:
-                logger.error(f"Error during loop: {e}")
-                time.sleep(delay)
+                logger.error(f"Error applying action: {e}")
+            finally:
+                actions.task_done()
+
+    async def run_game_loop(self, max_iterations: int = 1000, delay: float = 3.0):
+        # Only capture overlaps the rest: analyze waits for act to land each key before taking a frame
+        # captured after it, so sending action N no longer overlaps the Gemini call for frame N+1.
+        # Each queue only ever holds the newest item.
+        logger.info("Starting the Pokemon VLM bot.")
+        frames = asyncio.Queue(maxsize=1)
+        actions = asyncio.Queue(maxsize=1)
+        workers = [asyncio.create_task(self._capture_frames(frames, delay)),
+                   asyncio.create_task(self._apply_actions(actions))]
+        try:
+            await self._analyze_frames(frames, actions, max_iterations)
+            await actions.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
         logger.info("Game loop finished.")
 
     def save_game_state(self, filename: str = "game_state.json"):
         try:
-            with open(filename, 'w') as f:
-                json.dump(self.game_state, f, indent=2)
+            # default=list serializes the reasoning_history deque
+            data = orjson.dumps(self.game_state, default=list, option=orjson.OPT_INDENT_2)
+            # Write to a temp file and swap it in so a crash mid-save never truncates the old state
+            tmp_filename = f"{filename}.tmp"
+            with open(tmp_filename, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filename, filename)
             logger.info(f"Saved game state to {filename}")
         except Exception as e:
             logger.error(f"Couldn't save game state: {e}")
 
     def load_game_state(self, filename: str = "game_state.json"):
         try:
-            with open(filename, 'r') as f:
-                self.game_state = json.load(f)
+            with open(filename, 'rb') as f:
+                self.game_state = orjson.loads(f.read())
+            self.game_state["reasoning_history"] = deque(self.game_state.get("reasoning_history", []),
+                                                         maxlen=REASONING_HISTORY_LIMIT)
             logger.info(f"Loaded game state from {filename}")
         except Exception as e:
             logger.error(f"Couldn't load game state: {e}")
@@ -293,15 +563,16 @@ def main():
         logger.error("Gemini API key not set in .env file.")
         return
 
-    bot = PokemonVLMBot(GEMINI_API_KEY, DEVICE_NAME)
+    bot = PokemonVLMBot(GEMINI_API_KEY, DEVICE_NAME, int(EMULATOR_GRPC_PORT) if EMULATOR_GRPC_PORT else None)
     bot.load_game_state()
 
     try:
-        bot.run_game_loop(max_iterations=500, delay=2.0)
+        asyncio.run(bot.run_game_loop(max_iterations=500, delay=2.0))
     except KeyboardInterrupt:
         logger.info("Bot execution manually stopped.")
     finally:
         bot.save_game_state()
+        bot.close()
 
 if __name__ == "__main__":
     main()